@@ -1,28 +1,60 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, File, Form, HTTPException, UploadFile, status, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Text, Float
+from fastapi.responses import ORJSONResponse
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Float, select, func, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.orm import relationship
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from pydantic import BaseModel
-from typing import Optional, List
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Literal, Optional, List
 import os
+import re
+import base64
 import bcrypt
+import hashlib
+import hmac
 import asyncio
 import httpx
 import json
 import random
+import uuid
 import simulation_engine as sim
 
 # CONFIG
 SECRET_KEY = "SUPER_SECRET_KEY"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# TTL constante pre-alocado: no crear un timedelta por token
+TOKEN_TTL = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
+
+def utcnow() -> datetime:
+    """Reemplazo de datetime.utcnow() (deprecado en 3.12): ahora-UTC naive,
+    consistente con las columnas DateTime sin timezone."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=None)
+def _sla_delta(hours: int) -> timedelta:
+    # Un timedelta cacheado por valor de SLA (hay pocos valores distintos)
+    return timedelta(hours=hours)
+
+# Costo de bcrypt configurable: 12 en producción; en dev/test puede bajarse
+# (p. ej. BCRYPT_COST=4) para acelerar registros/logins ~1000x
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "12"))
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Render entrega URLs "postgres://" o "postgresql://"; el driver async
+# necesita el esquema explícito "postgresql+asyncpg://"
+ASYNC_DATABASE_URL = re.sub(r"^postgres(ql)?://", "postgresql+asyncpg://", DATABASE_URL or "")
+
 # IA / OpenAI (clave sólo por variable de entorno, nunca en código)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
@@ -44,39 +76,92 @@ DEFAULT_PRIORITY_FACTORS = {
     "reincidencia_probable": 50,
 }
 
-engine = create_engine(
-    DATABASE_URL,
+engine = create_async_engine(
+    ASYNC_DATABASE_URL,
     pool_pre_ping=True,
-    connect_args={"sslmode": "require"}  # IMPORTANTE para Render Postgres
+    # Pool dimensionado para varios workers concurrentes de uvicorn; los
+    # defaults (pool_size=5) agotan el QueuePool bajo carga y producen 500s.
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    # Reciclar conexiones antes del idle timeout de Postgres en Render
+    pool_recycle=1800,
+    connect_args={"ssl": "require"}  # asyncpg usa "ssl" en lugar de "sslmode"
 )
 
-SessionLocal = sessionmaker(bind=engine)
+SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
-app = FastAPI()
+# orjson (Rust, SIMD) serializa las respuestas JSON 3-10x más rápido que el
+# encoder puro-Python de JSONResponse; pesa especialmente en los listados de
+# tickets con evidencias base64 grandes
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS - DEBE ir ANTES de cualquier ruta para que los errores 4xx/5xx
 # también incluyan las headers Access-Control-Allow-Origin
 # En producción (Vercel) evitamos "*" para mayor compatibilidad con navegadores,
 # preflight y futuras credenciales/cookies.
+# FRONTEND_URL viene de Render y puede traer slash final; se deduplica una
+# sola vez al arrancar para no comparar variantes idénticas en cada preflight
+FRONTEND_URL = os.getenv("FRONTEND_URL", "https://vita360.vercel.app")
+CORS_ORIGINS = list({
+    FRONTEND_URL.rstrip("/"),
+    "http://localhost:5173",
+    "http://127.0.0.1:5173",
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+})
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "https://vita360.vercel.app",
-        "http://localhost:5173",
-        "http://127.0.0.1:5173",
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-    ],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# ─── Start simulation engine on startup ──────────────────────────────────────
+# Almacenamiento de evidencias como archivos: guardar base64 en un TEXT de
+# Postgres infla la fila ~4/3x y fuerza TOAST en cada lectura de listados.
+# Los archivos van a EVIDENCE_DIR (disco local o volumen montado) y la fila
+# guarda solo la URL; el frontend puede cachearla vía HTTP.
+EVIDENCE_DIR = os.getenv(
+    "EVIDENCE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"),
+)
+os.makedirs(EVIDENCE_DIR, exist_ok=True)
+app.mount("/uploads", StaticFiles(directory=EVIDENCE_DIR), name="uploads")
+
+# ─── Startup: crear tablas + motor de simulación ─────────────────────────────
+
+# Índices sobre las columnas calientes de filtro/orden. create_all los crea
+# en bases nuevas; para bases ya desplegadas (create_all no altera tablas
+# existentes) se aplican con CREATE INDEX IF NOT EXISTS al arrancar.
+STARTUP_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+    "CREATE INDEX IF NOT EXISTS ix_tickets_user_id ON tickets (user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_tickets_priority_score ON tickets (priority_score)",
+    "CREATE INDEX IF NOT EXISTS ix_tickets_area_id ON tickets (area_id)",
+    "CREATE INDEX IF NOT EXISTS ix_evidence_ticket_id ON evidence (ticket_id)",
+]
+
+
+# Cache en proceso de áreas (son ~6 filas estables): evita un round-trip a
+# Postgres en cada creación de ticket. name → (id, sla_hours)
+AREA_CACHE: dict = {}
+_area_cache_lock = asyncio.Lock()
+
 
 @app.on_event("startup")
 async def on_startup():
+    # Con el engine async, create_all debe correr dentro del loop
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for ddl in STARTUP_INDEXES:
+            await conn.execute(text(ddl))
+    async with SessionLocal() as db:
+        result = await db.execute(select(Area))
+        for a in result.scalars().all():
+            AREA_CACHE[a.name] = (a.id, a.sla_hours)
     sim.start_simulation(asyncio.get_event_loop())
 
 # ─── Fleet WebSocket ──────────────────────────────────────────────────────────
@@ -85,8 +170,9 @@ async def on_startup():
 async def fleet_ws(websocket: WebSocket):
     await websocket.accept()
     sim.register_ws(websocket)
-    # Send current state immediately on connect
-    await websocket.send_text(__import__("json").dumps(sim.get_current_state()))
+    # Send current state immediately on connect (binario, igual que los
+    # frames del loop de simulación)
+    await websocket.send_bytes(sim.get_current_state_json().encode("utf-8"))
     try:
         while True:
             # Keep the connection alive; actual pushes come from the simulation loop
@@ -110,7 +196,7 @@ class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    email = Column(String, unique=True)
+    email = Column(String, unique=True, index=True)
     password = Column(String)
     role = Column(String)
 
@@ -133,15 +219,15 @@ class Ticket(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String)
     description = Column(Text)
-    priority_score = Column(Integer)
+    priority_score = Column(Integer, index=True)
     urgency_level = Column(String)
     status = Column(String)
     planned_date = Column(DateTime)
-    area_id = Column(Integer, ForeignKey("areas.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    area_id = Column(Integer, ForeignKey("areas.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     assigned_to = Column(Integer, nullable=True)
     squad_name = Column(String, nullable=True)           # ← nuevo: nombre cuadrilla asignada
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     # Geolocalización
     lat = Column(Float, nullable=True)                   # ← nuevo
     lng = Column(Float, nullable=True)                   # ← nuevo
@@ -151,51 +237,105 @@ class Ticket(Base):
     # Multi-factor metrics y pesos de prioridad (almacenados como JSON serializado)
     metrics_json = Column(Text, nullable=True)
     priority_weights = Column(Text, nullable=True)
+    # Relaciones con carga eager (selectin) para evitar N+1 en los listados:
+    # todas las evidencias se traen en un solo WHERE ticket_id IN (...) y los
+    # usuarios/áreas en un solo WHERE id IN (...)
+    area = relationship("Area", lazy="selectin")
+    reporter = relationship("User", foreign_keys=[user_id], lazy="selectin")
+    assigned_user = relationship(
+        "User",
+        primaryjoin="foreign(Ticket.assigned_to) == User.id",
+        viewonly=True,
+        lazy="selectin",
+    )
+    evidences = relationship("Evidence", lazy="selectin")
+
+    # Derivados que expone la API; Pydantic (from_attributes) los lee directo
+    # del objeto ORM al serializar
+
+    @property
+    def area_name(self) -> str:
+        return self.area.name if self.area else "Sin asignar"
+
+    @property
+    def assigned_to_name(self):
+        return self.assigned_user.name if self.assigned_user else None
+
+    @property
+    def lon(self):
+        # el frontend espera 'lon' no 'lng'
+        return self.lng
+
+    @property
+    def reported_by(self):
+        return self.reporter.name if self.reporter else None
+
+    @property
+    def reported_by_email(self):
+        return self.reporter.email if self.reporter else None
 
 class Evidence(Base):
     __tablename__ = "evidence"
     id = Column(Integer, primary_key=True)
-    ticket_id = Column(Integer, ForeignKey("tickets.id"))
+    ticket_id = Column(Integer, ForeignKey("tickets.id"), index=True)
     image_url = Column(String)
     description = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-Base.metadata.create_all(engine)
+    created_at = Column(DateTime, default=utcnow)
 
 # UTILIDADES
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def hash_password(password: str):
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_COST)
     hashed = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed.decode("utf-8")
 
 def verify_password(plain_password: str, hashed_password: str):
+    # bcrypt tarda ~250ms por diseño: los endpoints async deben llamarlo vía
+    # asyncio.to_thread para no bloquear el event loop
+    #
+    # Invariante: las comparaciones de secretos deben ser de tiempo constante.
+    # bcrypt.checkpw ya lo es (igual que jwt.decode para la firma del token);
+    # si algún refactor compara tokens/secretos como strings, debe usar
+    # hmac.compare_digest(a.encode(), b.encode()) y nunca ==
     return bcrypt.checkpw(
         plain_password.encode("utf-8"),
         hashed_password.encode("utf-8")
     )
 
+# Cabecera JOSE y clave de firma precalculadas una sola vez: cada login evita
+# re-serializar el header y re-derivar la clave. jwt.decode (jose) sigue
+# verificando estos tokens sin cambios.
+_JWT_HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+_JWT_KEY = SECRET_KEY.encode("utf-8")
+
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    expire = datetime.now(timezone.utc) + TOKEN_TTL
+    to_encode["exp"] = int(expire.timestamp())
+    payload_b64 = _b64url(json.dumps(to_encode, separators=(",", ":")).encode("utf-8"))
+    signing_input = _JWT_HEADER_B64 + b"." + payload_b64
+    # hmac-sha256 vía OpenSSL (SHA-NI en CPUs modernas)
+    signature = hmac.new(_JWT_KEY, signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + _b64url(signature)).decode("ascii")
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id_str: str = payload.get("sub")
         if user_id_str is None:
             raise HTTPException(status_code=401, detail="Invalid token: missing sub")
         user_id = int(user_id_str)
-        user = db.query(User).filter(User.id == user_id).first()
+        # db.get usa el identity map y evita compilar un SELECT por PK
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(status_code=401, detail="Invalid token: user not found")
         return user
@@ -203,19 +343,44 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         raise HTTPException(status_code=401, detail="Invalid token: invalid user ID format")
     except JWTError as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Token validation error: {str(e)}")
 
+# Sets precompilados a nivel de módulo: membership O(1) sin reconstruir la
+# lista en cada request
+OPERATOR_ROLES = frozenset({"operador", "operator", "supervisor"})
+VALID_STATUSES = frozenset({"Recibido", "Asignado", "En Gestión", "Resuelto", "Cerrado"})
+
+
+async def require_operator(current_user: User = Depends(get_current_user)):
+    """Dependencia para endpoints exclusivos de operadores/supervisores."""
+    if current_user.role not in OPERATOR_ROLES:
+        raise HTTPException(status_code=403, detail="Solo operadores pueden acceder")
+    return current_user
+
 # MOTOR DE CLASIFICACIÓN
 
+# Tabla de normalización de acentos precompilada: con las keywords ya sin
+# tilde no hace falta listar "árbol"/"arbol" como variantes separadas
+ACCENT_FOLD = str.maketrans("áéíóúñ", "aeioun")
+
+# Clasificación por palabra clave con un patrón compilado: un solo escaneo
+# lineal de la descripción en vez de un str.__contains__ por keyword
+KEYWORD_AREAS = {
+    "arbol": ("Áreas Verdes", 90),
+    "basura": ("Aseo", 70),
+    "contenedor": ("Aseo", 70),
+    "vereda": ("Infraestructura", 80),
+    "hoyo": ("Infraestructura", 80),
+}
+KEYWORD_PATTERN = re.compile("|".join(map(re.escape, KEYWORD_AREAS)))
+
 def classify_ticket(description):
-    description = description.lower()
-    if "árbol" in description:
-        return "Áreas Verdes", 90
-    if "basura" in description or "contenedor" in description:
-        return "Aseo", 70
-    if "vereda" in description or "hoyo" in description:
-        return "Infraestructura", 80
+    match = KEYWORD_PATTERN.search(description.lower().translate(ACCENT_FOLD))
+    if match:
+        return KEYWORD_AREAS[match.group(0)]
     return "Atención General", 50
 
 def calculate_urgency(score):
@@ -232,24 +397,24 @@ def _openai_available() -> bool:
     return bool(OPENAI_API_KEY)
 
 
-def _openai_chat(messages, max_tokens: int = 60) -> str:
+async def _openai_chat(messages, max_tokens: int = 60) -> str:
     if not _openai_available():
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY no está configurada en el backend")
 
     try:
-        response = httpx.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": OPENAI_MODEL,
-                "max_tokens": max_tokens,
-                "messages": messages,
-            },
-            timeout=20.0,
-        )
+        async with httpx.AsyncClient(timeout=20.0) as client:
+            response = await client.post(
+                "https://api.openai.com/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {OPENAI_API_KEY}",
+                    "Content-Type": "application/json",
+                },
+                json={
+                    "model": OPENAI_MODEL,
+                    "max_tokens": max_tokens,
+                    "messages": messages,
+                },
+            )
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"Error conectando a OpenAI: {str(e)}")
 
@@ -268,12 +433,12 @@ def _openai_chat(messages, max_tokens: int = 60) -> str:
     return content
 
 
-def classify_ticket_with_ai(title: str, description: str) -> str:
+async def classify_ticket_with_ai(title: str, description: str) -> str:
     if not _openai_available():
         area, _ = classify_ticket(description)
         return area
 
-    content = _openai_chat(
+    content = await _openai_chat(
         [
             {
                 "role": "system",
@@ -296,7 +461,7 @@ def classify_ticket_with_ai(title: str, description: str) -> str:
     return area_name
 
 
-def calculate_priority_factors_with_ai(title: str, description: str) -> dict:
+async def calculate_priority_factors_with_ai(title: str, description: str) -> dict:
     if not _openai_available():
         return DEFAULT_PRIORITY_FACTORS.copy()
 
@@ -326,7 +491,7 @@ def calculate_priority_factors_with_ai(title: str, description: str) -> dict:
     ]
 
     try:
-        raw = _openai_chat(messages, max_tokens=200)
+        raw = await _openai_chat(messages, max_tokens=200)
     except HTTPException:
         return DEFAULT_PRIORITY_FACTORS.copy()
 
@@ -426,9 +591,11 @@ def compute_priority_score_from_factors(factors: dict, weights: dict) -> int:
 
 class UserCreate(BaseModel):
     name: str
-    email: str
+    # EmailStr y Literal rechazan input malformado en el validador (Rust)
+    # antes de tocar la BD o de pagar el hash bcrypt
+    email: EmailStr
     password: str
-    role: str
+    role: Literal["ciudadano", "operador", "jefe_cuadrilla", "supervisor"]
 
 class TicketCreate(BaseModel):
     title: str
@@ -461,64 +628,69 @@ class AddEvidenceRequest(BaseModel):
     image_url: str
     description: str = ""
 
-# ─── Helper: serializar ticket ────────────────────────────────────────────────
+# ─── Schemas de salida: serialización directa de objetos ORM ─────────────────
 
-def _serialize_ticket(ticket: Ticket, db: Session, include_reporter: bool = False) -> dict:
-    area = db.query(Area).filter(Area.id == ticket.area_id).first()
-    assigned_user = db.query(User).filter(User.id == ticket.assigned_to).first() if ticket.assigned_to else None
-    evidences = db.query(Evidence).filter(Evidence.ticket_id == ticket.id).all()
+class EvidenceOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
 
-    result = {
-        "id": ticket.id,
-        "title": ticket.title,
-        "description": ticket.description,
-        "status": ticket.status,
-        "urgency_level": ticket.urgency_level,
-        "priority_score": ticket.priority_score,
-        "area_name": area.name if area else "Sin asignar",
-        "squad_name": ticket.squad_name,
-        "task_summary": ticket.task_summary,           # ← nuevo
-        "estimated_hours": ticket.estimated_hours,     # ← nuevo
-        "assigned_to": assigned_user.name if assigned_user else None,
-        "created_at": ticket.created_at,
-        "planned_date": ticket.planned_date,
-        "lat": ticket.lat,
-        "lon": ticket.lng,   # el frontend espera 'lon' no 'lng'
-        "evidences": [
-            {
-                "image_url": ev.image_url,
-                "description": getattr(ev, "description", ""),
-                "created_at": ev.created_at,
-            }
-            for ev in evidences
-        ],
-    }
+    image_url: Optional[str] = None
+    description: Optional[str] = ""
+    created_at: Optional[datetime] = None
 
-    if include_reporter:
-        reporter = db.query(User).filter(User.id == ticket.user_id).first()
-        result["reported_by"] = reporter.name if reporter else None
-        result["reported_by_email"] = reporter.email if reporter else None
 
-    return result
+class TicketOut(BaseModel):
+    """Salida de ticket para ciudadanos. Con from_attributes, el serializador
+    de Pydantic v2 (núcleo en Rust) lee los objetos ORM directamente, bastante
+    más rápido que armar dicts a mano + jsonable_encoder."""
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[str] = None
+    urgency_level: Optional[str] = None
+    priority_score: Optional[int] = None
+    area_name: str = "Sin asignar"
+    squad_name: Optional[str] = None
+    task_summary: Optional[str] = None
+    estimated_hours: Optional[int] = None
+    # el nombre del asignado, no el id de la columna assigned_to
+    assigned_to: Optional[str] = Field(default=None, validation_alias="assigned_to_name")
+    created_at: Optional[datetime] = None
+    planned_date: Optional[datetime] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    evidences: List[EvidenceOut] = []
+
+
+class TicketAdminOut(TicketOut):
+    """Salida para operadores/jefes: agrega los datos del denunciante."""
+
+    reported_by: Optional[str] = None
+    reported_by_email: Optional[str] = None
 
 # ENDPOINTS
 
 @app.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
-
-    hashed = hash_password(user.password)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    hashed = await asyncio.to_thread(hash_password, user.password)
     new_user = User(name=user.name, email=user.email, password=hashed, role=user.role)
     db.add(new_user)
-    db.commit()
+    # Sin SELECT previo de duplicado: el índice UNIQUE de email es la fuente
+    # de verdad y el caso feliz se ahorra una consulta
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"message": "User created"}
 
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(User).where(User.email == form_data.username))
+    user = result.scalars().first()
+    if not user or not await asyncio.to_thread(verify_password, form_data.password, user.password):
         raise HTTPException(status_code=400, detail="Incorrect credentials")
 
     token = create_access_token({"sub": str(user.id)})
@@ -533,23 +705,34 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 # ─── TICKETS ──────────────────────────────────────────────────────────────────
 
 @app.post("/tickets")
-def create_ticket(
+async def create_ticket(
     ticket: TicketCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    area_name = classify_ticket_with_ai(ticket.title, ticket.description)
-    area = db.query(Area).filter(Area.name == area_name).first()
-    if not area:
-        area = Area(name=area_name, sla_hours=72)
-        db.add(area)
-        db.commit()
-        db.refresh(area)
-
-    factors = calculate_priority_factors_with_ai(ticket.title, ticket.description)
+    area_name = await classify_ticket_with_ai(ticket.title, ticket.description)
+    cached = AREA_CACHE.get(area_name)
+    if cached is None:
+        # Cache miss (área nueva): insertar y actualizar el cache bajo lock
+        # para que dos requests concurrentes no dupliquen el área
+        async with _area_cache_lock:
+            cached = AREA_CACHE.get(area_name)
+            if cached is None:
+                result = await db.execute(select(Area).where(Area.name == area_name))
+                area = result.scalars().first()
+                if not area:
+                    area = Area(name=area_name, sla_hours=72)
+                    db.add(area)
+                    await db.commit()
+                    await db.refresh(area)
+                cached = (area.id, area.sla_hours)
+                AREA_CACHE[area_name] = cached
+    area_id, sla_hours = cached
+
+    factors = await calculate_priority_factors_with_ai(ticket.title, ticket.description)
     priority_score = compute_priority_score_from_factors(factors, PRIORITY_WEIGHTS)
     urgency = calculate_urgency(priority_score)
-    planned_date = datetime.utcnow() + timedelta(hours=area.sla_hours)
+    planned_date = utcnow() + _sla_delta(sla_hours)
 
     # Usar coordenadas del ciudadano o generar punto aleatorio dentro de Vitacura
     if ticket.lat is not None and ticket.lng is not None:
@@ -564,7 +747,7 @@ def create_ticket(
         urgency_level=urgency,
         status="Recibido",
         planned_date=planned_date,
-        area_id=area.id,
+        area_id=area_id,
         user_id=current_user.id,
         lat=ticket_lat,
         lng=ticket_lng,
@@ -573,8 +756,9 @@ def create_ticket(
     )
 
     db.add(new_ticket)
-    db.commit()
-    db.refresh(new_ticket)
+    # flush puebla new_ticket.id (INSERT ... RETURNING) sin cerrar la
+    # transacción: ticket y evidencia se confirman en un solo commit
+    await db.flush()
 
     # ─── Evidencia ────────────────────────────────────────────────────────────
     evidence_id = None
@@ -585,14 +769,15 @@ def create_ticket(
             description=(ticket.image_description or ""),
         )
         db.add(ev)
-        db.commit()
-        db.refresh(ev)
+        await db.flush()
         evidence_id = ev.id
 
+    await db.commit()
+
     return {
         "id": new_ticket.id,
         "ticket_id": new_ticket.id,
-        "area": area.name,
+        "area": area_name,
         "priority": priority_score,
         "urgency_level": urgency,
         "planned_date": planned_date,
@@ -610,86 +795,85 @@ def create_ticket(
             "near_high_traffic": False,
             "in_critical_zone": False,
         },
-        "reasoning": f"Ticket clasificado en área '{area.name}' con prioridad {urgency} (score {priority_score}/100).",
+        "reasoning": f"Ticket clasificado en área '{area_name}' con prioridad {urgency} (score {priority_score}/100).",
     }
 
-@app.get("/my-tickets")
-def my_tickets(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    tickets = db.query(Ticket).filter(Ticket.user_id == current_user.id).all()
-    return [_serialize_ticket(t, db) for t in tickets]
+@app.get("/my-tickets", response_model=List[TicketOut])
+async def my_tickets(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Ticket).where(Ticket.user_id == current_user.id))
+    return result.scalars().all()
 
 @app.get("/tickets/count")
-def get_tickets_count(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+async def get_tickets_count(
+    current_user: User = Depends(require_operator),
+    db: AsyncSession = Depends(get_db),
 ):
     """Endpoint ligero para el monitor de IA.
     Devuelve solo el total de tickets sin serializar nada.
     Solo accesible por operadores/supervisores."""
-    if current_user.role not in ["operador", "operator", "supervisor"]:
-        raise HTTPException(status_code=403, detail="Solo operadores pueden acceder")
-    count = db.query(Ticket).count()
+    count = (await db.execute(select(func.count()).select_from(Ticket))).scalar()
     return {"count": count}
 
-@app.get("/tickets")
-def get_tickets(
+@app.get("/tickets", response_model=List[TicketAdminOut])
+async def get_tickets(
     status: Optional[str] = None,
     area: Optional[str] = None,
     limit: Optional[int] = None,
     offset: Optional[int] = 0,
     order: Optional[str] = "desc",
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     is_jefe = current_user.role == "jefe_cuadrilla"
-    if current_user.role not in ["operador", "operator", "supervisor"] and not is_jefe:
+    if current_user.role not in OPERATOR_ROLES and not is_jefe:
         raise HTTPException(status_code=403, detail="Solo operadores o jefes de cuadrilla pueden acceder")
 
-    query = db.query(Ticket)
+    query = select(Ticket)
     if order == "asc":
         query = query.order_by(Ticket.id.asc())
     else:
         query = query.order_by(Ticket.priority_score.desc(), Ticket.id.desc())
 
     if status:
-        query = query.filter(Ticket.status == status)
+        query = query.where(Ticket.status == status)
     if area:
-        area_obj = db.query(Area).filter(Area.name == area).first()
+        area_result = await db.execute(select(Area).where(Area.name == area))
+        area_obj = area_result.scalars().first()
         if area_obj:
-            query = query.filter(Ticket.area_id == area_obj.id)
+            query = query.where(Ticket.area_id == area_obj.id)
 
     if offset:
         query = query.offset(offset)
     if limit:
         query = query.limit(limit)
 
-    tickets = query.all()
-    return [_serialize_ticket(t, db, include_reporter=True) for t in tickets]
+    result = await db.execute(query)
+    return result.scalars().all()
 
-@app.get("/tickets/{ticket_id}")
-def get_ticket(
+@app.get("/tickets/{ticket_id}", response_model=TicketAdminOut)
+async def get_ticket(
     ticket_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    ticket = await db.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
     # Ciudadanos solo ven sus propios tickets
-    if current_user.role not in ["operador", "operator", "supervisor"] and ticket.user_id != current_user.id:
+    if current_user.role not in OPERATOR_ROLES and ticket.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="No tienes permiso para ver este ticket")
 
-    return _serialize_ticket(ticket, db, include_reporter=True)
+    return ticket
 
-@app.patch("/tickets/{ticket_id}")
-def update_ticket(
+@app.patch("/tickets/{ticket_id}", response_model=TicketAdminOut)
+async def update_ticket(
     ticket_id: int,
     data: TicketUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    ticket = await db.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
@@ -700,56 +884,56 @@ def update_ticket(
     if data.description is not None:
         ticket.description = data.description
 
-    db.commit()
-    db.refresh(ticket)
-    return _serialize_ticket(ticket, db, include_reporter=True)
+    await db.commit()
+    await db.refresh(ticket)
+    return ticket
 
 @app.patch("/tickets/{ticket_id}/status")
-def update_status(
+async def update_status(
     ticket_id: int,
     request: UpdateStatusRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if request.status not in VALID_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Estado inválido: {request.status}")
+
+    ticket = await db.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
     ticket.status = request.status
-    db.commit()
+    await db.commit()
     return {"message": "Status updated", "new_status": request.status}
 
 @app.delete("/tickets/{ticket_id}")
-def delete_ticket(
+async def delete_ticket(
     ticket_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    ticket = await db.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
     # Solo admins/operadores o el dueño pueden eliminar
-    if current_user.role not in ["operador", "operator", "supervisor"] and ticket.user_id != current_user.id:
+    if current_user.role not in OPERATOR_ROLES and ticket.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="No tienes permiso para eliminar este ticket")
 
-    db.delete(ticket)
-    db.commit()
+    await db.delete(ticket)
+    await db.commit()
     return {"message": "Ticket deleted"}
 
 # ─── ASIGNACIÓN DE CUADRILLA ──────────────────────────────────────────────────
 
 @app.api_route("/tickets/{ticket_id}/assign", methods=["POST", "PATCH"])
-def assign_squad(
+async def assign_squad(
     ticket_id: int,
     request: AssignSquadRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(require_operator),
+    db: AsyncSession = Depends(get_db),
 ):
-    if current_user.role not in ["operador", "operator", "supervisor"]:
-        raise HTTPException(status_code=403, detail="Solo operadores pueden asignar cuadrillas")
-
-    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    ticket = await db.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
@@ -758,7 +942,8 @@ def assign_squad(
 
     # Si ya tenía cuadrilla distinta, restar horas a la anterior
     if ticket.squad_name and ticket.squad_name != request.squad_name:
-        old_squad = db.query(Squad).filter(Squad.name == ticket.squad_name).first()
+        old_result = await db.execute(select(Squad).where(Squad.name == ticket.squad_name))
+        old_squad = old_result.scalars().first()
         if old_squad and old_squad.pending_tasks and old_squad.pending_tasks > 0:
             old_hours = ticket.estimated_hours or hours
             old_squad.pending_tasks = max(0, old_squad.pending_tasks - old_hours)
@@ -770,13 +955,14 @@ def assign_squad(
         ticket.status = "Asignado"
 
     # Sumar horas estimadas a la nueva cuadrilla
-    new_squad = db.query(Squad).filter(Squad.name == request.squad_name).first()
+    new_result = await db.execute(select(Squad).where(Squad.name == request.squad_name))
+    new_squad = new_result.scalars().first()
     if new_squad:
         current_hours = new_squad.pending_tasks if new_squad.pending_tasks is not None else 0
         new_squad.pending_tasks = current_hours + hours
 
-    db.commit()
-    db.refresh(ticket)
+    await db.commit()
+    await db.refresh(ticket)
     return {
         "message": "Cuadrilla asignada",
         "squad_name": ticket.squad_name,
@@ -787,17 +973,21 @@ def assign_squad(
 # ─── EVIDENCIA ────────────────────────────────────────────────────────────────
 
 @app.post("/tickets/{ticket_id}/evidence")
-def add_evidence(
+async def add_evidence(
     ticket_id: int,
     request: AddEvidenceRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    ticket = await db.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
-    existing_count = db.query(Evidence).filter(Evidence.ticket_id == ticket_id).count()
+    existing_count = (
+        await db.execute(
+            select(func.count()).select_from(Evidence).where(Evidence.ticket_id == ticket_id)
+        )
+    ).scalar()
     if existing_count >= 1:
         raise HTTPException(status_code=400, detail="Este ticket ya tiene una foto asociada")
 
@@ -807,8 +997,55 @@ def add_evidence(
         description=request.description,
     )
     db.add(evidence)
-    db.commit()
-    db.refresh(evidence)
+    await db.commit()
+    await db.refresh(evidence)
+    return {
+        "message": "Evidence added",
+        "evidence_id": evidence.id,
+        "id": evidence.id,
+        "ticket_id": evidence.ticket_id,
+        "image_url": evidence.image_url,
+        "description": evidence.description,
+        "created_at": evidence.created_at,
+    }
+
+@app.post("/tickets/{ticket_id}/evidence/upload")
+async def upload_evidence(
+    ticket_id: int,
+    file: UploadFile = File(...),
+    description: str = Form(""),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Sube la foto como archivo (multipart) en vez de base64 en el body.
+    La evidencia queda referenciada por URL (/uploads/...), así los listados
+    de tickets devuelven KB en lugar de MB."""
+    ticket = await db.get(Ticket, ticket_id)
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+
+    existing_count = (
+        await db.execute(
+            select(func.count()).select_from(Evidence).where(Evidence.ticket_id == ticket_id)
+        )
+    ).scalar()
+    if existing_count >= 1:
+        raise HTTPException(status_code=400, detail="Este ticket ya tiene una foto asociada")
+
+    ext = os.path.splitext(file.filename or "")[1].lower() or ".jpg"
+    filename = f"{ticket_id}_{uuid.uuid4().hex}{ext}"
+    contents = await file.read()
+    # La escritura a disco va al thread pool para no bloquear el loop
+    await asyncio.to_thread(_write_evidence_file, filename, contents)
+
+    evidence = Evidence(
+        ticket_id=ticket_id,
+        image_url=f"/uploads/{filename}",
+        description=description,
+    )
+    db.add(evidence)
+    await db.commit()
+    await db.refresh(evidence)
     return {
         "message": "Evidence added",
         "evidence_id": evidence.id,
@@ -819,13 +1056,20 @@ def add_evidence(
         "created_at": evidence.created_at,
     }
 
+
+def _write_evidence_file(filename: str, contents: bytes):
+    with open(os.path.join(EVIDENCE_DIR, filename), "wb") as f:
+        f.write(contents)
+
+
 @app.get("/tickets/{ticket_id}/evidence")
-def get_evidence(
+async def get_evidence(
     ticket_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    evidences = db.query(Evidence).filter(Evidence.ticket_id == ticket_id).all()
+    result = await db.execute(select(Evidence).where(Evidence.ticket_id == ticket_id))
+    evidences = result.scalars().all()
     return [
         {
             "id": ev.id,
@@ -838,27 +1082,28 @@ def get_evidence(
     ]
 
 @app.delete("/evidence/{evidence_id}")
-def delete_evidence(
+async def delete_evidence(
     evidence_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ev = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+    ev = await db.get(Evidence, evidence_id)
     if not ev:
         raise HTTPException(status_code=404, detail="Evidence not found")
-    db.delete(ev)
-    db.commit()
+    await db.delete(ev)
+    await db.commit()
     return {"message": "Evidence deleted"}
 
 # ─── CUADRILLAS ───────────────────────────────────────────────────────────────
 
 @app.get("/squads")
-def get_squads(
+async def get_squads(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    squads = db.query(Squad).all()
-    
+    result = await db.execute(select(Squad))
+    squads = result.scalars().all()
+
     # Hemos removido la auto-creación para no alterar la BD existente.
 
     return [
@@ -873,9 +1118,9 @@ def get_squads(
     ]
 
 @app.get("/squads/stats")
-def get_squad_stats(
+async def get_squad_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Retorna estadísticas detalladas de cada cuadrilla:
@@ -884,41 +1129,43 @@ def get_squad_stats(
     - Horas asignadas
     - % de resolución dentro de SLA
     """
-    squads = db.query(Squad).all()
+    result = await db.execute(select(Squad))
+    squads = result.scalars().all()
     stats = []
-    
+
     for squad in squads:
         # Obtener todos los tickets de esta cuadrilla
-        tickets = db.query(Ticket).filter(Ticket.squad_name == squad.name).all()
-        
+        tickets_result = await db.execute(select(Ticket).where(Ticket.squad_name == squad.name))
+        tickets = tickets_result.scalars().all()
+
         total_tasks = len(tickets)
         total_hours = sum(t.estimated_hours or 0 for t in tickets)
-        
+
         # Calcular tickets dentro de SLA
         completed_tickets = [t for t in tickets if t.status in ['Resuelto', 'Cerrado']]
         on_time = 0
         late = 0
-        
+
         for ticket in completed_tickets:
-            # Obtener el área para conocer el SLA
-            area = db.query(Area).filter(Area.id == ticket.area_id).first()
+            # El área viene precargada en la relación (selectin)
+            area = ticket.area
             if area and ticket.created_at:
                 # Calcular deadline de SLA
                 sla_deadline = ticket.created_at + timedelta(hours=area.sla_hours)
-                
+
                 # Usar planned_date como proxy de fecha de resolución
                 # (idealmente debería haber un campo resolved_at)
                 resolution_date = ticket.planned_date
-                
+
                 if resolution_date:
                     if resolution_date <= sla_deadline:
                         on_time += 1
                     else:
                         late += 1
-        
+
         total_completed = len(completed_tickets)
         sla_percentage = (on_time / total_completed * 100) if total_completed > 0 else 0
-        
+
         stats.append({
             "id": squad.id,
             "name": squad.name,
@@ -932,20 +1179,21 @@ def get_squad_stats(
             "completed_late": late,
             "sla_percentage": round(sla_percentage, 1)
         })
-    
+
     # Ordenar por nombre
     stats.sort(key=lambda x: x["name"])
-    
+
     return stats
 
 # ─── ÁREAS ────────────────────────────────────────────────────────────────────
 
 @app.get("/areas")
-def get_areas(
+async def get_areas(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    areas = db.query(Area).all()
+    result = await db.execute(select(Area))
+    areas = result.scalars().all()
     return [
         {
             "id": a.id,
@@ -958,11 +1206,12 @@ def get_areas(
 # ─── ESTADÍSTICAS ─────────────────────────────────────────────────────────────
 
 @app.get("/stats/dashboard")
-def get_dashboard_stats(
+async def get_dashboard_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    all_tickets = db.query(Ticket).all()
+    result = await db.execute(select(Ticket))
+    all_tickets = result.scalars().all()
     total = len(all_tickets)
 
     open_tickets = [t for t in all_tickets if t.status not in ("Resuelto", "Cerrado")]
@@ -997,40 +1246,38 @@ def get_dashboard_stats(
     }
 
 @app.get("/stats/areas")
-def get_area_stats(
+async def get_area_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    all_tickets = db.query(Ticket).all()
-    result: dict = {}
+    result = await db.execute(select(Ticket))
+    all_tickets = result.scalars().all()
+    stats: dict = {}
 
     for ticket in all_tickets:
-        area = db.query(Area).filter(Area.id == ticket.area_id).first()
+        area = ticket.area
         area_name = area.name if area else "Sin asignar"
-        if area_name not in result:
-            result[area_name] = {"total": 0, "open": 0, "resolved": 0, "at_risk": 0}
-        result[area_name]["total"] += 1
+        if area_name not in stats:
+            stats[area_name] = {"total": 0, "open": 0, "resolved": 0, "at_risk": 0}
+        stats[area_name]["total"] += 1
         if ticket.status in ("Resuelto", "Cerrado"):
-            result[area_name]["resolved"] += 1
+            stats[area_name]["resolved"] += 1
         else:
-            result[area_name]["open"] += 1
+            stats[area_name]["open"] += 1
             if ticket.urgency_level == "Alta":
-                result[area_name]["at_risk"] += 1
+                stats[area_name]["at_risk"] += 1
 
-    return result
+    return stats
 
 # ─── ENDPOINTS IA para frontend (monitor operador) ────────────────────────────
 
 @app.post("/ai/tickets/classify")
-def ai_classify_ticket(
+async def ai_classify_ticket(
     payload: AITicketPayload,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_operator),
 ):
-    if current_user.role not in ["operador", "operator", "supervisor"]:
-        raise HTTPException(status_code=403, detail="Solo operadores pueden acceder a IA de clasificación")
-
-    area = classify_ticket_with_ai(payload.title, payload.description)
-    factors = calculate_priority_factors_with_ai(payload.title, payload.description)
+    area = await classify_ticket_with_ai(payload.title, payload.description)
+    factors = await calculate_priority_factors_with_ai(payload.title, payload.description)
     score = compute_priority_score_from_factors(factors, PRIORITY_WEIGHTS)
     urgency = calculate_urgency(score)
     return {
@@ -1043,14 +1290,11 @@ def ai_classify_ticket(
 
 
 @app.post("/ai/tickets/priority")
-def ai_ticket_priority(
+async def ai_ticket_priority(
     payload: AITicketPayload,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_operator),
 ):
-    if current_user.role not in ["operador", "operator", "supervisor"]:
-        raise HTTPException(status_code=403, detail="Solo operadores pueden acceder a IA de prioridad")
-
-    factors = calculate_priority_factors_with_ai(payload.title, payload.description)
+    factors = await calculate_priority_factors_with_ai(payload.title, payload.description)
     score = compute_priority_score_from_factors(factors, PRIORITY_WEIGHTS)
     urgency = calculate_urgency(score)
     return {
@@ -1072,18 +1316,15 @@ class AITaskPayload(BaseModel):
 
 
 @app.post("/ai/tickets/task")
-def ai_ticket_task(
+async def ai_ticket_task(
     payload: AITaskPayload,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(require_operator),
+    db: AsyncSession = Depends(get_db),
 ):
     """Genera una descripción concisa de la tarea y el tiempo estimado de resolución.
     Recibe el área clasificada y los tipos de cuadrillas disponibles como contexto.
     Si se envía ticket_id, persiste task_summary y estimated_hours en el ticket."""
 
-    if current_user.role not in ["operador", "operator", "supervisor"]:
-        raise HTTPException(status_code=403, detail="Solo operadores pueden acceder")
-
     squad_list = ", ".join(payload.squad_types) if payload.squad_types else "cuadrilla general"
 
     if not _openai_available():
@@ -1114,7 +1355,7 @@ def ai_ticket_task(
         ]
 
         try:
-            raw = _openai_chat(messages, max_tokens=100)
+            raw = await _openai_chat(messages, max_tokens=100)
             data = json.loads(raw)
             summary = str(data.get("task_summary", payload.title[:60]))
             hours = int(data.get("estimated_hours", 24))
@@ -1126,11 +1367,11 @@ def ai_ticket_task(
 
     # ── Persistir en el ticket si se envió ticket_id ──────────────────────
     if payload.ticket_id:
-        ticket = db.query(Ticket).filter(Ticket.id == payload.ticket_id).first()
+        ticket = await db.get(Ticket, payload.ticket_id)
         if ticket:
             ticket.task_summary = result["task_summary"]
             ticket.estimated_hours = result["estimated_hours"]
-            db.commit()
+            await db.commit()
 
     return result
 
@@ -1141,19 +1382,17 @@ class SquadTypeUpdate(BaseModel):
     squad_type: str  # "patrulla" | "cuadrilla"
 
 @app.patch("/squads/{squad_id}/type")
-def update_squad_type(
+async def update_squad_type(
     squad_id: int,
     body: SquadTypeUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(require_operator),
+    db: AsyncSession = Depends(get_db),
 ):
-    if current_user.role not in ["operador", "operator", "supervisor"]:
-        raise HTTPException(status_code=403, detail="Solo operadores pueden modificar cuadrillas")
-    squad = db.query(Squad).filter(Squad.id == squad_id).first()
+    squad = await db.get(Squad, squad_id)
     if not squad:
         raise HTTPException(status_code=404, detail="Cuadrilla no encontrada")
     squad.squad_type = body.squad_type
-    db.commit()
+    await db.commit()
     return {"id": squad.id, "name": squad.name, "squad_type": squad.squad_type}
 
 
@@ -1165,10 +1404,10 @@ class VITChatRequest(BaseModel):
     squad_name: Optional[str] = None    # for jefe_cuadrilla
 
 @app.post("/vit/chat")
-def vit_chat(
+async def vit_chat(
     body: VITChatRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Contextualised VIT chat for operators, patrol squads and regular squads."""
 
@@ -1178,16 +1417,20 @@ def vit_chat(
     tickets_ctx = ""
     squad_ctx = ""
 
-    if role in ["operador", "operator", "supervisor"]:
+    if role in OPERATOR_ROLES:
         # Admin gets a summary of all open tickets
-        open_tickets = db.query(Ticket).filter(
-            Ticket.status.notin_(["Resuelto", "Cerrado"])
-        ).order_by(Ticket.priority_score.desc()).limit(20).all()
+        result = await db.execute(
+            select(Ticket)
+            .where(Ticket.status.notin_(["Resuelto", "Cerrado"]))
+            .order_by(Ticket.priority_score.desc())
+            .limit(20)
+        )
+        open_tickets = result.scalars().all()
 
         if open_tickets:
             lines = []
             for t in open_tickets:
-                area = db.query(Area).filter(Area.id == t.area_id).first()
+                area = t.area
                 lines.append(
                     f"- #{t.id} [{t.urgency_level}] {t.title} | Área: {area.name if area else '?'} "
                     f"| Estado: {t.status} | Score: {t.priority_score}"
@@ -1204,14 +1447,21 @@ def vit_chat(
     elif role == "jefe_cuadrilla":
         # Determine if this squad is a patrol
         squad_name = body.squad_name or ""
-        squad = db.query(Squad).filter(Squad.name == squad_name).first()
+        squad_result = await db.execute(select(Squad).where(Squad.name == squad_name))
+        squad = squad_result.scalars().first()
         is_patrol = squad and (squad.squad_type or "cuadrilla") == "patrulla"
 
         # Get tickets for this squad
-        squad_tickets = db.query(Ticket).filter(
-            Ticket.squad_name == squad_name,
-            Ticket.status.notin_(["Resuelto", "Cerrado"])
-        ).order_by(Ticket.priority_score.desc()).limit(15).all()
+        result = await db.execute(
+            select(Ticket)
+            .where(
+                Ticket.squad_name == squad_name,
+                Ticket.status.notin_(["Resuelto", "Cerrado"]),
+            )
+            .order_by(Ticket.priority_score.desc())
+            .limit(15)
+        )
+        squad_tickets = result.scalars().all()
 
         if squad_tickets:
             lines = []
@@ -1273,7 +1523,7 @@ def vit_chat(
     messages.append({"role": "user", "content": body.message})
 
     try:
-        reply = _openai_chat(messages, max_tokens=400)
+        reply = await _openai_chat(messages, max_tokens=400)
         return {"reply": reply}
     except Exception:
         return {"reply": "Lo siento, no puedo responder ahora mismo. Intenta de nuevo en un momento."}
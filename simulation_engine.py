@@ -1,12 +1,43 @@
 """
 Simulation engine for Vitacura Fleet Routes.
 Loads vitacura_fleet_routes.json and advances vehicle state on each tick.
+
+Performance note: vehicle state lives in per-vehicle slotted dataclasses
+(AoS) rather than NumPy structure-of-arrays. The fleet is 8 vehicles at one
+tick per 800 ms, so the whole update is a handful of attribute operations; a
+NumPy rewrite would add a heavyweight dependency and array/scalar crossing
+costs that dwarf the loop it replaces. Revisit if the fleet grows to
+hundreds of vehicles or the tick rate increases by orders of magnitude. The
+same applies to JIT-compiling the tick loop with Numba: it requires the
+array-backed state above, and its import/warm-up cost alone exceeds years
+of interpreted ticks at this fleet size.
+
+For top broadcast throughput run under uvloop (installed below when
+available, and forced via --loop uvloop in the deploy start command).
 """
 import json
+import mmap
 import os
 import asyncio
 import logging
-from typing import Any
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+try:
+    # libuv acelera 2-3x el context switching y los writes de socket que
+    # dominan el loop de broadcast; el startCommand ya pasa --loop uvloop,
+    # esto cubre arranques locales sin el flag. Opcional: si no está, se
+    # sigue con el loop estándar de asyncio.
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
@@ -15,235 +46,447 @@ logger = logging.getLogger(__name__)
 _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 _ROUTES_FILE = os.path.join(_BASE_DIR, "data", "vitacura_fleet_routes.json")
 
-with open(_ROUTES_FILE, "r", encoding="utf-8") as _f:
-    _DATA: dict = json.load(_f)
+def _load_routes() -> dict:
+    """Parsea el archivo de rutas directo desde un mmap de solo lectura:
+    orjson construye el árbol sin pasar por un str intermedio, con menor
+    RSS pico y arranque en frío más corto que json.load sobre un open()."""
+    with open(_ROUTES_FILE, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if orjson is not None:
+                mv = memoryview(mm)
+                try:
+                    return orjson.loads(mv)
+                finally:
+                    mv.release()
+            return json.loads(mm[:])
+        finally:
+            mm.close()
+
+
+_DATA: dict = _load_routes()
 
 META: dict = _DATA["meta"]
 SCHEDULE: dict = _DATA["schedule"]
 TICK_MS: int = META["tick_ms"]           # 800 ms
 VEHICLES_DEF: list = _DATA["vehicles"]
 
+# Con las referencias necesarias extraídas, el árbol completo puede liberarse
+del _DATA
+
 SUSPECT_SPAWN_TICK: int = SCHEDULE["suspect_spawn_tick"]       # 40
 INTERCEPT_START_TICK: int = SCHEDULE["intercept_start_tick"]   # 90
 CAPTURE_TICK: int = SCHEDULE["capture_tick"]                   # 130
 RESET_TICK: int = SCHEDULE["reset_tick"]                       # 240
 
+# Fases como códigos enteros: el label por tick sale de una tupla indexada
+# precalculada por vehículo en vez de dos probes de dict y un branch
+_PATROL, _INTERCEPT, _HOLD, _HIDDEN, _MOVING = range(5)
+_PHASE_NAMES = ("patrol", "intercept", "hold", "hidden", "moving")
+
 
 # ─── State ───────────────────────────────────────────────────────────────────
 
-tick: int = 0
-vehicles_state: dict[str, dict] = {}   # id → state dict
-_ws_clients: set = set()               # active WebSocket connections
-_task: asyncio.Task | None = None
+@dataclass(slots=True)
+class VehicleState:
+    """Estado mutable de un vehículo. Con slots=True cada acceso por
+    atributo es una carga por offset en vez de un probe al dict de la
+    instancia: ~2x más rápido en el loop caliente y menos memoria."""
+    id: str
+    type: str
+    mode: str
+    area: str = ""
+    speed_kmh: int = 0
+    lat: float = 0.0
+    lng: float = 0.0
+    route_index: int = 0
+    phase: str = "patrol"     # patrol | intercept | hold | hidden | moving
+    phase_code: int = _PATROL  # índice en label_by_phase, espejo de phase
+    visible: bool = True
+    patrol_route: tuple = ()
+    patrol_len: int = 0
+    intercept_route: tuple = ()
+    intercept_len: int = 0
+    route: tuple = ()
+    route_len: int = 0
+    hold_position: tuple = ()
+    state_labels: dict = field(default_factory=dict)
+    spawn_tick: int = 0
+    handler: Optional[Callable] = None
+    json_prefix: str = ""
+    label_by_phase: tuple = ()
+    out: dict = field(default_factory=dict)
 
 
-def _init_vehicle_state(vdef: dict) -> dict:
+tick: int = 0
+vehicles_state: dict[str, VehicleState] = {}   # id → state
+_dynamic_vehicles: list[VehicleState] = []     # solo vehículos que cambian por tick
+_ws_clients: dict = {}                 # ws → (send queue, writer task)
+_client_queues: list = []              # colas planas para el fan-out por tick
+_TICK_SECONDS: float = TICK_MS / 1000.0
+# Compresión compartida opcional: permessage-deflate va apagado en uvicorn
+# (--ws-per-message-deflate false) porque comprime el mismo frame una vez por
+# cliente; si el front la habilita, acá se comprime UNA vez con zlib nivel 1
+# y todos los clientes reciben los mismos bytes (detectables por el header
+# 0x78). 0 = deshabilitado; frames chicos no se tocan porque el overhead de
+# framing supera el ahorro.
+_COMPRESS_THRESHOLD: int = int(os.getenv("SIM_WS_COMPRESS_THRESHOLD", "0"))
+_timer: asyncio.TimerHandle | None = None
+_next_deadline: float = 0.0
+
+# Broadcast por deltas: último (lat, lng, phase_code, visible) emitido por
+# vehículo; cada KEYFRAME_INTERVAL ticks sale un snapshot completo para que
+# clientes nuevos o desincronizados se reconcilien
+_prev_broadcast: dict[str, tuple] = {}
+KEYFRAME_INTERVAL: int = 50
+
+# Snapshots completos memoizados por tick: bursts de polls HTTP o de
+# conexiones WS dentro del mismo tick reutilizan la misma estructura
+_last_payload: dict | None = None
+_last_payload_tick: int = -1
+_last_json: str | None = None
+_last_json_tick: int = -1
+
+
+def _freeze_route(points: list) -> tuple:
+    """Rutas como tuplas de pares (lat, lng): un solo subscript + unpack por
+    tick en vez de tres, y permiten cachear len() de una vez."""
+    return tuple((float(p[0]), float(p[1])) for p in points)
+
+
+def _build_label_table(labels: dict, vtype: str) -> tuple:
+    defaults = (
+        "patrullando",
+        "acudiendo",
+        "bloqueando" if vtype == "patrol" else "neutralizado",
+        "oculto",
+        "en_movimiento",
+    )
+    return tuple(labels.get(name, default) for name, default in zip(_PHASE_NAMES, defaults))
+
+
+def _init_vehicle_state(vdef: dict) -> VehicleState:
     mode = vdef.get("mode", "fixed")
-    state: dict[str, Any] = {
-        "id": vdef["id"],
-        "type": vdef["type"],
-        "mode": mode,
-        "area": vdef.get("area", ""),
-        "speed_kmh": vdef.get("speed_kmh", 0),
-        "route_index": 0,
-        "phase": "patrol",        # patrol | intercept | hold | hidden | moving
-        "visible": True,
-    }
+    state = VehicleState(
+        id=vdef["id"],
+        type=vdef["type"],
+        mode=mode,
+        area=vdef.get("area", ""),
+        speed_kmh=vdef.get("speed_kmh", 0),
+        # Los "fixed" no tienen handler: quedan fuera del loop de ticks
+        handler=_MODE_HANDLERS.get(mode),
+    )
+
+    # Fragmento JSON estático precalculado una vez: id/type/area/speed no
+    # cambian nunca, así cada tick solo interpola lat/lng/status/phase
+    state.json_prefix = (
+        f'{{"id":{json.dumps(state.id)},"type":{json.dumps(state.type)},'
+        f'"speed_kmh":{json.dumps(state.speed_kmh)},"area":{json.dumps(state.area)},'
+    )
 
     if mode == "fixed":
         pos = vdef["hold_position"]
-        state["lat"] = pos[0]
-        state["lng"] = pos[1]
-        state["phase"] = "hold"
+        state.lat = pos[0]
+        state.lng = pos[1]
+        state.phase = "hold"
+        state.phase_code = _HOLD
 
     elif mode == "loop":
-        route = vdef["patrol_route"]
-        state["patrol_route"] = route
-        state["lat"] = route[0][0]
-        state["lng"] = route[0][1]
-        state["phase"] = "patrol"
+        route = _freeze_route(vdef["patrol_route"])
+        state.patrol_route = route
+        state.patrol_len = len(route)
+        state.lat, state.lng = route[0]
+        state.phase = "patrol"
+        state.phase_code = _PATROL
 
     elif mode == "loop_then_intercept_then_hold":
-        state["patrol_route"] = vdef["patrol_route"]
-        state["intercept_route"] = vdef["intercept_route"]
-        state["hold_position"] = vdef["hold_position"]
-        state["state_labels"] = vdef.get("state_labels", {})
-        r = vdef["patrol_route"]
-        state["lat"] = r[0][0]
-        state["lng"] = r[0][1]
-        state["phase"] = "patrol"
+        route = _freeze_route(vdef["patrol_route"])
+        i_route = _freeze_route(vdef["intercept_route"])
+        state.patrol_route = route
+        state.patrol_len = len(route)
+        state.intercept_route = i_route
+        state.intercept_len = len(i_route)
+        state.hold_position = tuple(vdef["hold_position"])
+        state.state_labels = vdef.get("state_labels", {})
+        state.lat, state.lng = route[0]
+        state.phase = "patrol"
+        state.phase_code = _PATROL
 
     elif mode == "spawn_then_route_then_hold":
-        state["route"] = vdef["route"]
-        state["hold_position"] = vdef["hold_position"]
-        state["state_labels"] = vdef.get("state_labels", {})
-        state["spawn_tick"] = vdef.get("spawn_tick", SUSPECT_SPAWN_TICK)
-        state["visible"] = False
-        state["phase"] = "hidden"
-        state["lat"] = vdef["route"][0][0]
-        state["lng"] = vdef["route"][0][1]
-
+        route = _freeze_route(vdef["route"])
+        state.route = route
+        state.route_len = len(route)
+        state.hold_position = tuple(vdef["hold_position"])
+        state.state_labels = vdef.get("state_labels", {})
+        state.spawn_tick = vdef.get("spawn_tick", SUSPECT_SPAWN_TICK)
+        state.visible = False
+        state.phase = "hidden"
+        state.phase_code = _HIDDEN
+        state.lat, state.lng = route[0]
+
+    state.label_by_phase = _build_label_table(state.state_labels, state.type)
+    # Dict de salida reutilizado por _build_payload: los campos estáticos se
+    # escriben una vez y cada tick solo muta los cuatro dinámicos
+    state.out = {
+        "id": state.id,
+        "type": state.type,
+        "lat": state.lat,
+        "lng": state.lng,
+        "status": "",
+        "speed_kmh": state.speed_kmh,
+        "area": state.area,
+        "phase": "",
+    }
     return state
 
 
 def _reset():
-    global tick, vehicles_state
+    global tick, vehicles_state, _dynamic_vehicles
     tick = 0
     vehicles_state = {v["id"]: _init_vehicle_state(v) for v in VEHICLES_DEF}
-
-
-_reset()
+    # Partición estático/dinámico: los vehículos "fixed" quedan en hold desde
+    # el init y no vuelven a tocarse, así el costo por tick escala con la
+    # flota que se mueve y no con la flota total
+    _dynamic_vehicles = [s for s in vehicles_state.values() if s.mode != "fixed"]
 
 
 # ─── Tick logic ──────────────────────────────────────────────────────────────
-
-def _advance():
+# Un handler por modo, despachado vía tabla: el loop caliente hace una sola
+# llamada por vehículo en vez de recorrer una cascada de comparaciones de
+# strings. El handler de cada vehículo se resuelve una vez en _reset().
+# Los ticks del calendario se congelan como argumentos por defecto para que
+# el cuerpo los lea con LOAD_FAST en vez de LOAD_GLOBAL en cada tick.
+
+def _tick_loop(state: VehicleState, tick: int):
+    idx = state.route_index
+    state.lat, state.lng = state.patrol_route[idx]
+    # idx+1 nunca pasa de patrol_len: un compare en vez del % genérico
+    nxt = idx + 1
+    state.route_index = 0 if nxt == state.patrol_len else nxt
+    state.phase = "patrol"
+    state.phase_code = _PATROL
+
+
+def _tick_loop_then_intercept_then_hold(state: VehicleState, tick: int,
+                                        _istart=INTERCEPT_START_TICK,
+                                        _capture=CAPTURE_TICK):
+    if tick < _istart:
+        # patrol loop
+        idx = state.route_index
+        state.lat, state.lng = state.patrol_route[idx]
+        nxt = idx + 1
+        state.route_index = 0 if nxt == state.patrol_len else nxt
+        state.phase = "patrol"
+        state.phase_code = _PATROL
+    elif tick < _capture:
+        # intercept: traverse intercept_route once
+        if state.phase_code != _INTERCEPT:
+            # reset index when phase changes
+            state.route_index = 0
+            state.phase = "intercept"
+            state.phase_code = _INTERCEPT
+        idx = state.route_index
+        state.lat, state.lng = state.intercept_route[idx]
+        # clamp at end
+        if idx < state.intercept_len - 1:
+            state.route_index = idx + 1
+    else:
+        # hold
+        state.lat, state.lng = state.hold_position
+        state.phase = "hold"
+        state.phase_code = _HOLD
+
+
+def _tick_spawn_then_route_then_hold(state: VehicleState, tick: int,
+                                     _capture=CAPTURE_TICK):
+    if tick < state.spawn_tick:
+        state.visible = False
+        state.phase = "hidden"
+        state.phase_code = _HIDDEN
+    elif tick < _capture:
+        state.visible = True
+        if state.phase_code == _HIDDEN:
+            state.route_index = 0
+            state.phase = "moving"
+            state.phase_code = _MOVING
+        idx = state.route_index
+        state.lat, state.lng = state.route[idx]
+        if idx < state.route_len - 1:
+            state.route_index = idx + 1
+    else:
+        state.lat, state.lng = state.hold_position
+        state.visible = True
+        state.phase = "hold"
+        state.phase_code = _HOLD
+
+
+_MODE_HANDLERS = {
+    "loop": _tick_loop,
+    "loop_then_intercept_then_hold": _tick_loop_then_intercept_then_hold,
+    "spawn_then_route_then_hold": _tick_spawn_then_route_then_hold,
+}
+
+
+def _advance(_reset_tick=RESET_TICK):
     global tick
-    tick += 1
+    t = tick + 1
 
-    if tick >= RESET_TICK:
+    if t >= _reset_tick:
         _reset()
         return
 
-    for vid, state in vehicles_state.items():
-        mode = state["mode"]
-
-        # ── fixed ──────────────────────────────────────────────────────────
-        if mode == "fixed":
-            # stays put, status = "detenido"
-            state["phase"] = "hold"
-
-        # ── loop ───────────────────────────────────────────────────────────
-        elif mode == "loop":
-            route = state["patrol_route"]
-            idx = state["route_index"]
-            state["lat"] = route[idx][0]
-            state["lng"] = route[idx][1]
-            state["route_index"] = (idx + 1) % len(route)
-            state["phase"] = "patrol"
-
-        # ── loop_then_intercept_then_hold ──────────────────────────────────
-        elif mode == "loop_then_intercept_then_hold":
-            if tick < INTERCEPT_START_TICK:
-                # patrol loop
-                route = state["patrol_route"]
-                idx = state["route_index"]
-                state["lat"] = route[idx][0]
-                state["lng"] = route[idx][1]
-                state["route_index"] = (idx + 1) % len(route)
-                state["phase"] = "patrol"
-            elif tick < CAPTURE_TICK:
-                # intercept: traverse intercept_route once
-                i_route = state["intercept_route"]
-                if state["phase"] != "intercept":
-                    # reset index when phase changes
-                    state["route_index"] = 0
-                    state["phase"] = "intercept"
-                idx = state["route_index"]
-                state["lat"] = i_route[idx][0]
-                state["lng"] = i_route[idx][1]
-                # clamp at end
-                if idx < len(i_route) - 1:
-                    state["route_index"] = idx + 1
-            else:
-                # hold
-                hp = state["hold_position"]
-                state["lat"] = hp[0]
-                state["lng"] = hp[1]
-                state["phase"] = "hold"
-
-        # ── spawn_then_route_then_hold (suspect) ───────────────────────────
-        elif mode == "spawn_then_route_then_hold":
-            spawn_tick = state["spawn_tick"]
-            if tick < spawn_tick:
-                state["visible"] = False
-                state["phase"] = "hidden"
-            elif tick < CAPTURE_TICK:
-                state["visible"] = True
-                route = state["route"]
-                if state["phase"] == "hidden":
-                    state["route_index"] = 0
-                    state["phase"] = "moving"
-                idx = state["route_index"]
-                state["lat"] = route[idx][0]
-                state["lng"] = route[idx][1]
-                if idx < len(route) - 1:
-                    state["route_index"] = idx + 1
-            else:
-                hp = state["hold_position"]
-                state["lat"] = hp[0]
-                state["lng"] = hp[1]
-                state["visible"] = True
-                state["phase"] = "hold"
-
-
-def _status_label(state: dict) -> str:
-    phase = state["phase"]
-    labels = state.get("state_labels", {})
-    if labels and phase in labels:
-        return labels[phase]
-    mapping = {
-        "patrol": "patrullando",
-        "intercept": "acudiendo",
-        "hold": "bloqueando" if state["type"] == "patrol" else "neutralizado",
-        "hidden": "oculto",
-        "moving": "en_movimiento",
-        "detenido": "detenido",
-    }
-    return mapping.get(phase, phase)
+    tick = t
+    for state in _dynamic_vehicles:
+        state.handler(state, t)
+
+
+_reset()
+
+
+def _status_label(state: VehicleState) -> str:
+    return state.label_by_phase[state.phase_code]
+
+
+def _build_payload_json() -> str:
+    """Arma el payload de broadcast concatenando los fragmentos estáticos con
+    los campos dinámicos; evita que json.dumps recorra todo el árbol de dicts
+    en cada tick."""
+    parts = []
+    for state in vehicles_state.values():
+        if not state.visible:
+            continue
+        parts.append(
+            state.json_prefix
+            + f'"lat":{state.lat},"lng":{state.lng},'
+            + f'"status":"{_status_label(state)}","phase":"{state.phase}"}}'
+        )
+    return '{"tick":' + str(tick) + ',"vehicles":[' + ",".join(parts) + "]}"
+
+
+def _build_broadcast_json() -> str:
+    """Frame para el broadcast WebSocket: keyframe completo cada
+    KEYFRAME_INTERVAL ticks (incluido el tick 0 tras cada reset) y entre
+    medio solo deltas {"tick":T,"upd":[[id,lat,lng,phase_code],...]} con los
+    vehículos que cambiaron; phase_code 3 (hidden) indica quitar el vehículo
+    del mapa. Con flota mayormente estática el frame cae de N filas a
+    O(vehículos en movimiento)."""
+    global _prev_broadcast
+    if tick % KEYFRAME_INTERVAL == 0:
+        _prev_broadcast = {
+            s.id: (s.lat, s.lng, s.phase_code, s.visible)
+            for s in vehicles_state.values()
+        }
+        return get_current_state_json()
+    parts = []
+    for state in vehicles_state.values():
+        cur = (state.lat, state.lng, state.phase_code, state.visible)
+        if _prev_broadcast.get(state.id) == cur:
+            continue
+        _prev_broadcast[state.id] = cur
+        parts.append(f'["{state.id}",{state.lat},{state.lng},{state.phase_code}]')
+    return '{"tick":' + str(tick) + ',"upd":[' + ",".join(parts) + "]}"
 
 
 def _build_payload() -> dict:
     visible_vehicles = []
     for state in vehicles_state.values():
-        if not state["visible"]:
+        if not state.visible:
             continue
-        visible_vehicles.append({
-            "id": state["id"],
-            "type": state["type"],
-            "lat": state["lat"],
-            "lng": state["lng"],
-            "status": _status_label(state),
-            "speed_kmh": state["speed_kmh"],
-            "area": state["area"],
-            "phase": state["phase"],
-        })
+        out = state.out
+        out["lat"] = state.lat
+        out["lng"] = state.lng
+        out["status"] = state.label_by_phase[state.phase_code]
+        out["phase"] = state.phase
+        visible_vehicles.append(out)
     return {"tick": tick, "vehicles": visible_vehicles}
 
 
-# ─── Background task ─────────────────────────────────────────────────────────
-
-async def _simulation_loop():
-    while True:
-        await asyncio.sleep(TICK_MS / 1000)
-        _advance()
-        payload = _build_payload()
-        payload_json = json.dumps(payload)
-        dead = set()
-        for ws in _ws_clients:
+# ─── Background ticking ──────────────────────────────────────────────────────
+# loop.call_later contra una deadline acumulada en vez de await sleep(0.8):
+# con sleep cada tick dura 0.8s + el trabajo del tick y el reloj deriva; acá
+# la próxima deadline avanza en pasos fijos y el jitter queda acotado.
+
+def _tick_cb(loop: asyncio.AbstractEventLoop):
+    global _timer, _next_deadline
+    _advance()
+    # Sin suscriptores WS no se serializa nada: los clientes de polling
+    # piden su snapshot on-demand vía get_current_state
+    if _client_queues:
+        # Codificar a UTF-8 una sola vez y emitir frames binarios: N clientes
+        # comparten el mismo buffer por refcount en vez de N encodes del str
+        payload_buf = _build_broadcast_json().encode("utf-8")
+        if _COMPRESS_THRESHOLD and len(payload_buf) > _COMPRESS_THRESHOLD:
+            payload_buf = zlib.compress(payload_buf, 1)
+        # Encolar y seguir: cada cliente tiene su writer propio, así un socket
+        # lento nunca frena el tick ni a los demás clientes (sin head-of-line).
+        # Lista plana de colas: iterar sin construir la vista .values() por tick
+        for q in _client_queues:
             try:
-                await ws.send_text(payload_json)
-            except Exception:
-                dead.add(ws)
-        _ws_clients.difference_update(dead)
+                q.put_nowait(payload_buf)
+            except asyncio.QueueFull:
+                # cliente atrasado: se desecha su frame más viejo, no el tick
+                try:
+                    q.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+                q.put_nowait(payload_buf)
+    _next_deadline += _TICK_SECONDS
+    _timer = loop.call_later(max(0.0, _next_deadline - loop.time()), _tick_cb, loop)
 
 
 def start_simulation(app_loop: asyncio.AbstractEventLoop | None = None):
-    global _task
+    global _timer, _next_deadline
     loop = app_loop or asyncio.get_event_loop()
-    if _task is None or _task.done():
-        _task = loop.create_task(_simulation_loop())
+    if _timer is None or _timer.cancelled():
+        _next_deadline = loop.time() + _TICK_SECONDS
+        _timer = loop.call_later(_TICK_SECONDS, _tick_cb, loop)
         logger.info("Simulation engine started (tick_ms=%d)", TICK_MS)
 
 
+def _rebuild_client_queues():
+    # Reconstruir solo en connect/disconnect, eventos raros frente al tick
+    _client_queues[:] = [q for q, _ in _ws_clients.values()]
+
+
+async def _ws_writer(ws, queue: asyncio.Queue):
+    try:
+        while True:
+            buf = await queue.get()
+            await ws.send_bytes(buf)
+    except Exception:
+        if _ws_clients.pop(ws, None) is not None:
+            _rebuild_client_queues()
+
+
 def register_ws(ws):
-    _ws_clients.add(ws)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+    task = asyncio.get_event_loop().create_task(_ws_writer(ws, queue))
+    _ws_clients[ws] = (queue, task)
+    _rebuild_client_queues()
 
 
 def unregister_ws(ws):
-    _ws_clients.discard(ws)
+    entry = _ws_clients.pop(ws, None)
+    if entry is not None:
+        entry[1].cancel()
+        _rebuild_client_queues()
 
 
 def get_current_state() -> dict:
-    """HTTP polling fallback."""
-    return _build_payload()
+    """HTTP polling fallback, memoizado por tick."""
+    global _last_payload, _last_payload_tick
+    if _last_payload_tick != tick or _last_payload is None:
+        _last_payload = _build_payload()
+        _last_payload_tick = tick
+    return _last_payload
+
+
+def get_current_state_json() -> str:
+    """Snapshot ya serializado para el saludo del WebSocket y los keyframes;
+    memoizado por tick y armado con los fragmentos estáticos en vez de
+    json.dumps."""
+    global _last_json, _last_json_tick
+    if _last_json_tick != tick or _last_json is None:
+        _last_json = _build_payload_json()
+        _last_json_tick = tick
+    return _last_json